@@ -1,12 +1,17 @@
 import argparse
+import asyncio
+import functools
+import hashlib
+import json
 import os
 import re
 import subprocess
 import sys
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from pathlib import Path
-from tempfile import NamedTemporaryFile
 
 # ------------------- Third-party imports (with friendly error) -------------
 try:
@@ -25,10 +30,12 @@ HERE = Path(__file__).resolve().parent
 CONFIG_TXT = HERE / "config.txt"
 
 
+@functools.lru_cache(maxsize=4)
 def _parse_simple_kv(path: Path) -> dict:
     """
     Parse key=value lines, ignoring blank lines and comments (#).
     Keys are upper-cased. Values are raw (stripped).
+    Cached per path; callers must not mutate the returned dict.
     """
     cfg = {}
     if not path.exists():
@@ -68,10 +75,15 @@ def load_gpt_options() -> dict:
         max_tokens = int(kv.get("MAX_TOKENS", "2000"))
     except ValueError:
         max_tokens = 2000
+    try:
+        max_concurrent = max(1, int(kv.get("MAX_CONCURRENT_REQUESTS", "4")))
+    except ValueError:
+        max_concurrent = 4
     return {
         "default_model": default_model,
         "temperature": temperature,
         "max_tokens": max_tokens,
+        "max_concurrent_requests": max_concurrent,
     }
 
 
@@ -80,6 +92,7 @@ GPT_CFG = load_gpt_options()
 DEFAULT_MODEL = GPT_CFG["default_model"]
 TEMPERATURE = GPT_CFG["temperature"]
 MAX_TOKENS = GPT_CFG["max_tokens"]
+MAX_CONCURRENT_REQUESTS = GPT_CFG["max_concurrent_requests"]
 
 # Set key for both new and legacy clients
 os.environ["OPENAI_API_KEY"] = API_KEY
@@ -97,6 +110,15 @@ try:
 except Exception:
     _OPENAI_NEW_CLIENT = None
 
+# Async client (openai>=1.x) for dispatching independent prompts concurrently
+_ASYNC_CLIENT = None
+try:
+    from openai import AsyncOpenAI
+
+    _ASYNC_CLIENT = AsyncOpenAI(api_key=API_KEY)
+except Exception:
+    _ASYNC_CLIENT = None
+
 
 # ------------------- IO Layout (UPDATED) -----------------------------------
 # We now work directly in the script folder:
@@ -113,6 +135,22 @@ FOLDERS = {
 for p in FOLDERS.values():
     p.mkdir(parents=True, exist_ok=True)
 
+# stem -> observed CSV path, filled by index_observed() with one directory read
+OBSERVED_INDEX = {}
+
+
+def index_observed(folder: Path) -> dict:
+    with os.scandir(folder) as it:
+        return {
+            e.name[:-len(".csv")]: Path(e.path)
+            for e in it
+            if e.name.endswith(".csv") and e.is_file()
+        }
+
+
+def observed_path(stem: str) -> Path:
+    return OBSERVED_INDEX.get(stem) or FOLDERS["observed"] / f"{stem}.csv"
+
 
 # ------------------- Prompts (EXACTLY AS GIVEN) ----------------------------
 PROMPT_D1 = """AI Role:
@@ -236,30 +274,110 @@ PROMPTS = {
 }
 
 
+def _split_template(template: str):
+    """Split a prompt around its single {placeholder} -> (prefix, suffix)."""
+    m = re.search(r"\{\w+\}", template)
+    return template[:m.start()], template[m.end():]
+
+
+# Pre-split once at import; fill_prompt() is plain concatenation (no str.format)
+PROMPT_PARTS = {
+    ctx: {k: _split_template(v) for k, v in d.items()} for ctx, d in PROMPTS.items()
+}
+PROMPT_CO_PARTS = _split_template(PROMPT_CO)
+
+
+def fill_prompt(parts, value: str) -> str:
+    return parts[0] + value + parts[1]
+
+
 # ------------------- Utilities ---------------------------------------------
 def ensure_dir(path: Path):
     path.mkdir(parents=True, exist_ok=True)
 
 
+def _csv_text(df: pd.DataFrame) -> str:
+    """Serialize a frame as CSV text (for prompts) straight into one buffer."""
+    buf = StringIO()
+    df.to_csv(buf, index=False, lineterminator="\n")
+    return buf.getvalue()
+
+
+# Responses keyed by (model, temperature, max_tokens, prompt); disable with --no-cache
+LLM_CACHE_DIR = HERE / ".llm_cache"
+USE_LLM_CACHE = True
+
+
+def _cache_file(prompt: str) -> Path:
+    key = hashlib.blake2b(
+        f"{DEFAULT_MODEL}|{TEMPERATURE}|{MAX_TOKENS}|{prompt}".encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+    return LLM_CACHE_DIR / key
+
+
+def _cache_get(prompt: str):
+    """Return the cached response for 'prompt', or None (empty counts as a miss)."""
+    if not USE_LLM_CACHE:
+        return None
+    try:
+        text = _cache_file(prompt).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    return text or None
+
+
+def _cache_put(prompt: str, text: str) -> str:
+    """
+    Store a non-empty response and return it unchanged.
+    Written to a temp file and renamed into place, so an interrupted run or
+    a concurrent BioShift process never sees a partial entry.
+    """
+    if USE_LLM_CACHE and text:
+        ensure_dir(LLM_CACHE_DIR)
+        path = _cache_file(prompt)
+        fd, tmp = tempfile.mkstemp(dir=LLM_CACHE_DIR, prefix=path.name + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(text)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return text
+
+
+def _delta_text(chunk) -> str:
+    """Text carried by one streamed chat.completions chunk ("" if none)."""
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
 def call_openai(prompt: str) -> str:
     """
     Fireproof OpenAI call:
-    - Try new client (openai>=1.x) first
+    - Try new client (openai>=1.x) first, streaming the reply
     - Fallback to legacy openai.ChatCompletion (<=0.x)
     - Retry 3 times with small backoff
+    - Reuse a cached response for an identical request (see LLM_CACHE_DIR)
     """
+    cached = _cache_get(prompt)
+    if cached is not None:
+        return cached
     last_err = None
     for attempt in range(1, 4):
         try:
             if _OPENAI_NEW_CLIENT is not None:
-                resp = _OPENAI_NEW_CLIENT.chat.completions.create(
+                stream = _OPENAI_NEW_CLIENT.chat.completions.create(
                     model=DEFAULT_MODEL,
                     messages=[{"role": "user", "content": prompt}],
                     temperature=TEMPERATURE,
                     max_tokens=MAX_TOKENS,
+                    stream=True,
                 )
-                text = resp.choices[0].message.content or ""
-                return text.strip()
+                text = "".join(_delta_text(chunk) for chunk in stream)
+                return _cache_put(prompt, text.strip())
             else:
                 resp = openai.ChatCompletion.create(
                     model=DEFAULT_MODEL,
@@ -268,7 +386,7 @@ def call_openai(prompt: str) -> str:
                     max_tokens=MAX_TOKENS,
                 )
                 text = resp["choices"][0]["message"]["content"] or ""
-                return text.strip()
+                return _cache_put(prompt, text.strip())
         except Exception as e:
             print(f" OpenAI error ({attempt}/3): {e}")
             last_err = e
@@ -277,15 +395,58 @@ def call_openai(prompt: str) -> str:
     return ""
 
 
+async def _acall_openai(prompt: str, sem: asyncio.Semaphore) -> str:
+    """
+    Async twin of call_openai (same retry/backoff), bounded by 'sem'.
+    Falls back to the sync call in a worker thread without the async client.
+    """
+    cached = _cache_get(prompt)
+    if cached is not None:
+        return cached
+    async with sem:
+        if _ASYNC_CLIENT is None:
+            return await asyncio.to_thread(call_openai, prompt)
+        for attempt in range(1, 4):
+            try:
+                stream = await _ASYNC_CLIENT.chat.completions.create(
+                    model=DEFAULT_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                    stream=True,
+                )
+                text = "".join([_delta_text(chunk) async for chunk in stream])
+                return _cache_put(prompt, text.strip())
+            except Exception as e:
+                print(f" OpenAI error ({attempt}/3): {e}")
+                await asyncio.sleep(2 * attempt)
+        print("Returning empty string after repeated OpenAI failures.")
+        return ""
+
+
+def call_openai_many(prompts) -> list:
+    """
+    Run independent prompts concurrently (at most MAX_CONCURRENT_REQUESTS
+    in flight). Returns responses in the same order as 'prompts'.
+    """
+    async def _gather():
+        sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return await asyncio.gather(*(_acall_openai(p, sem) for p in prompts))
+
+    return list(asyncio.run(_gather()))
+
+
+# Any line containing a '|' (scanned in one pass instead of line by line)
+_PIPE_ROW = re.compile(r"^[^\n|]*\|.*$", re.M)
+
+
 def _extract_clean_table(raw: str, min_cols: int = 2) -> str:
     """
     Extract only the pipe-separated lines from an LLM response.
     Keeps header/body rows that contain '|' and at least 'min_cols' parts.
     """
     lines = []
-    for line in (raw or "").splitlines():
-        if "|" not in line:
-            continue
+    for line in _PIPE_ROW.findall(raw or ""):
         parts = [p.strip() for p in line.split("|")]
         if len(parts) >= min_cols and any(parts):
             # Rebuild with single '|' as separators, trimmed cells
@@ -298,16 +459,10 @@ def extract_elements(observed_path: Path, elements_path: Path):
     cols = [c for c in df.columns if c.lower().startswith("element")]
     if not cols:
         raise ValueError(f"No 'Element' column found in {observed_path}")
-    elements = (
-        df[cols[0]]
-        .astype(str)
-        .map(lambda x: x.strip())
-        .replace({"nan": ""})
-        .dropna()
-        .unique()
-    )
+    names = df[cols[0]].astype(str).str.strip()
+    elements = names[names.ne("") & names.ne("nan")].unique()
     ensure_dir(elements_path.parent)
-    Path(elements_path).write_text("\n".join([e for e in elements if e]), encoding="utf-8")
+    Path(elements_path).write_text("\n".join(elements), encoding="utf-8")
     return elements, df
 
 
@@ -328,14 +483,25 @@ def _read_pipe_table_or_empty(text: str, expected_cols_min=2) -> pd.DataFrame:
         # Drop autogenerated columns and trim
         df = df.loc[:, ~df.columns.astype(str).str.contains("^Unnamed")]
         df.columns = df.columns.map(lambda c: str(c).strip())
-        for col in df.columns:
-            df[col] = df[col].astype(str).map(lambda x: x.strip()).replace("nan", "")
-        return df
+        return df.astype(str).apply(lambda s: s.str.strip()).replace("nan", "")
     except Exception as e:
         print(f"Could not parse LLM table: {e}")
         return pd.DataFrame()
 
 
+def _merge_on_element(left: pd.DataFrame, right: pd.DataFrame, how: str, **kwargs) -> pd.DataFrame:
+    """
+    Merge two frames on 'Element' using shared categorical codes (integer-keyed
+    hash join, no key sorting). 'Element' is plain strings again afterwards.
+    """
+    cats = pd.Index(pd.concat([left["Element"], right["Element"]]).unique())
+    left = left.assign(Element=pd.Categorical(left["Element"], categories=cats))
+    right = right.assign(Element=pd.Categorical(right["Element"], categories=cats))
+    merged = pd.merge(left, right, on="Element", how=how, sort=False, **kwargs)
+    merged["Element"] = merged["Element"].astype(object)
+    return merged
+
+
 def clean_and_save_table_ab(promptA: str, promptB: str, out_csv: Path) -> pd.DataFrame:
     a = _read_pipe_table_or_empty(promptA, expected_cols_min=2)
     b = _read_pipe_table_or_empty(promptB, expected_cols_min=2)
@@ -355,9 +521,9 @@ def clean_and_save_table_ab(promptA: str, promptB: str, out_csv: Path) -> pd.Dat
     def _drop_bad(df):
         if "Element" not in df.columns:
             return df.iloc[0:0]  # empty
-        drop_patterns = [r"^[-\s]*$", r"^element$", r"^$"]
-        pattern = "|".join(drop_patterns)
-        mask = ~df["Element"].astype(str).str.strip().str.lower().str.match(pattern)
+        # Drop blank / dash-only separator rows and repeated "element" headers
+        s = df["Element"].astype(str).str.strip().str.lower()
+        mask = s.ne("element") & s.str.replace("-", "", regex=False).str.strip().ne("")
         return df[mask].copy()
 
     a = _drop_bad(a)
@@ -367,7 +533,7 @@ def clean_and_save_table_ab(promptA: str, promptB: str, out_csv: Path) -> pd.Dat
     if "Element" not in a.columns and "Element" not in b.columns:
         table_ab = pd.DataFrame(columns=["Element"])
     elif "Element" in a.columns and "Element" in b.columns:
-        table_ab = pd.merge(a, b, on="Element", how="outer", suffixes=("_A", "_B"))
+        table_ab = _merge_on_element(a, b, how="outer", suffixes=("_A", "_B"))
     elif "Element" in a.columns:
         table_ab = a.copy()
     else:
@@ -381,44 +547,51 @@ def clean_and_save_table_ab(promptA: str, promptB: str, out_csv: Path) -> pd.Dat
 
     # Strip junk
     table_ab = table_ab.loc[:, ~table_ab.columns.astype(str).str.contains("^Unnamed")]
-    for col in table_ab.columns:
-        table_ab[col] = (
-            table_ab[col]
-            .astype(str)
-            .map(lambda x: x.strip())
-            .replace("nan", "")
-        )
+    table_ab = table_ab.astype(str).apply(lambda s: s.str.strip()).replace("nan", "").fillna("")
 
-    table_ab = table_ab.fillna("").sort_values("Element", kind="stable").reset_index(drop=True)
+    table_ab = table_ab.sort_values("Element", kind="stable").reset_index(drop=True)
     ensure_dir(Path(out_csv).parent)
     table_ab.to_csv(out_csv, index=False, encoding="utf-8")
     print(f"Clean TableAB saved: {out_csv}")
     return table_ab
 
 
-def run_prompt_co(csv_path: Path, out_base: Path):
-    """Run Prompt_Co on a CSV file and save output to 'Prompt_Co_Output/<stem>_PromptCo_output.txt'."""
+def build_prompt_co(csv_path: Path):
+    """Return the Prompt_Co text for a CSV file, or None if it cannot be read."""
     if not csv_path.exists():
         print(f"CSV not found: {csv_path}")
-        return
+        return None
     try:
         df = pd.read_csv(csv_path)
     except Exception as e:
         print(f"Failed to read {csv_path}: {e}")
+        return None
+
+    return fill_prompt(PROMPT_CO_PARTS, _csv_text(df))
+
+
+def run_prompt_co(csv_path: Path, out_base: Path):
+    """Run Prompt_Co on a CSV file and save output to 'Prompt_Co_Output/<stem>_PromptCo_output.txt'."""
+    prompt_text = build_prompt_co(csv_path)
+    if prompt_text is None:
         return
+    save_prompt_co(csv_path.stem, call_openai(prompt_text), out_base)
 
-    csv_text = df.to_csv(index=False)
-    prompt_text = PROMPT_CO.format(csv_data=csv_text)
-    output_text = call_openai(prompt_text)
 
+def save_prompt_co(stem: str, output_text: str, out_base: Path):
     out_dir = Path(out_base) / "Prompt_Co_Output"
     ensure_dir(out_dir)
-    out_file = out_dir / f"{csv_path.stem}_PromptCo_output.txt"
+    out_file = out_dir / f"{stem}_PromptCo_output.txt"
     out_file.write_text(output_text, encoding="utf-8")
     print(f"Prompt_Co output saved: {out_file}")
 
 
 # ------------------- Graphviz highlighting ---------------------------------
+# Node lines like  "NodeName" [ ... ]  (group 1 = name, group 2 = attrs)
+_DOT_NODE = re.compile(r'^[^\S\n]*"([^"\n]+)"[^\S\n]*\[(.*)\].*$', re.M)
+_SHIFT_COLORS = {"1": "green", "-1": "blue"}
+
+
 def graph_highlight(sample: str, t3_path: Path, out_graph_dir: Path):
     """
     Highlight matched elements in ALL Graphviz files under inputs/graphviz.
@@ -440,12 +613,13 @@ def graph_highlight(sample: str, t3_path: Path, out_graph_dir: Path):
             print(f"Table3 missing '{col}'. Skipping highlight.")
             return
 
-    df["Element"] = df["Element"].astype(str).map(lambda x: x.strip())
+    df["Element"] = df["Element"].astype(str).str.strip()
     # Normalize shift like "1.0" -> "1"
     df["Observed Shift"] = (
         df["Observed Shift"]
         .astype(str)
-        .map(lambda x: re.sub(r"\.0+$", "", x.strip()))
+        .str.strip()
+        .str.replace(r"\.0+$", "", regex=True)
     )
 
     ensure_dir(out_graph_dir)
@@ -454,69 +628,75 @@ def graph_highlight(sample: str, t3_path: Path, out_graph_dir: Path):
         print(f"No Graphviz files found in {FOLDERS['graphviz']}. Put .dot/.txt files there.")
         return
 
+    # Element -> fill color; an element's first row decides, other shifts stay unchanged
+    first = df.drop_duplicates("Element")
+    color_map = {
+        el: _SHIFT_COLORS[s]
+        for el, s in zip(first["Element"].to_numpy(), first["Observed Shift"].to_numpy())
+        if s in _SHIFT_COLORS
+    }
+
+    def _color_node(m):
+        color = color_map.get(m.group(1))
+        if color is None:
+            return m.group(0)
+        # Append (do not remove existing attrs)
+        return f'"{m.group(1)}" [{m.group(2)}, style=filled, fillcolor={color}]'
+
+    jobs = []  # (graph_file, rewritten dot text, jpg_out)
     for graph_file in graph_files:
         try:
-            text = graph_file.read_text(encoding="utf-8", errors="ignore").splitlines()
+            text = graph_file.read_text(encoding="utf-8", errors="ignore")
         except Exception as e:
             print(f"Could not read {graph_file}: {e}")
             continue
 
-        new_lines = []
-        for ln in text:
-            hit = False
-            for el, s in zip(df["Element"], df["Observed Shift"]):
-                # Match lines like  "NodeName" [ ... ]
-                if re.match(rf'\s*"{re.escape(el)}"\s*\[', ln):
-                    color = "green" if s == "1" else ("blue" if s == "-1" else None)
-                    if color:
-                        try:
-                            attrs = ln.split("[", 1)[1].rsplit("]", 1)[0]
-                            # Append (do not remove existing attrs)
-                            nl = f'"{el}" [{attrs}, style=filled, fillcolor={color}]'
-                            # Preserve trailing newline if any
-                            if ln.endswith("\n"):
-                                nl += "\n"
-                            new_lines.append(nl)
-                        except Exception:
-                            new_lines.append(ln)  # fail-safe
-                    else:
-                        new_lines.append(ln)
-                    hit = True
-                    break
-            if not hit:
-                new_lines.append(ln)
+        new_text = _DOT_NODE.sub(_color_node, text)
 
         jpg_out = Path(out_graph_dir) / f"{sample}_{graph_file.stem}_highlighted.jpg"
-        with NamedTemporaryFile("w", delete=False, suffix=".dot", encoding="utf-8") as tmp:
-            tmp.write("\n".join(new_lines))
-            tmp_path = Path(tmp.name)
+        jobs.append((graph_file, new_text, jpg_out))
 
-        try:
-            # Requires Graphviz 'dot' executable on PATH
-            subprocess.run(["dot", "-Tjpg", str(tmp_path), "-o", str(jpg_out)],
-                           check=True, capture_output=True)
+    # Each 'dot' is its own process -> render all graphs at once
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as ex:
+        errors = list(ex.map(lambda job: _render_dot(job[1], job[2]), jobs))
+
+    for (graph_file, _, jpg_out), err in zip(jobs, errors):
+        if err is None:
             print(f"Highlighted graph saved: {jpg_out}")
-        except FileNotFoundError:
+        elif isinstance(err, FileNotFoundError):
             print("Graphviz 'dot' not found. Install Graphviz and ensure 'dot' is on PATH.")
             return
-        except subprocess.CalledProcessError as e:
-            print(f"Graphviz 'dot' error for {graph_file}:\n{e.stderr.decode(errors='ignore')}")
-        finally:
-            try:
-                tmp_path.unlink(missing_ok=True)
-            except Exception:
-                pass
+        else:
+            print(f"Graphviz 'dot' error for {graph_file}:\n{err.stderr.decode(errors='ignore')}")
+
+
+def _render_dot(dot_text: str, jpg_out: Path):
+    """Render dot source (fed on stdin) to JPEG. Returns None on success, else the error."""
+    try:
+        # Requires Graphviz 'dot' executable on PATH
+        subprocess.run(["dot", "-Tjpg", "-o", str(jpg_out)],
+                       input=dot_text.encode("utf-8"), check=True, capture_output=True)
+        return None
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        return e
 
 
 # ------------------- Observed workflow helpers -----------------------------
 def run_prompt_set(elements, context: str, prompt_dir: Path):
-    t = PROMPTS[context]
-    outA = call_openai(t["A"].format(elements="\n".join(elements)))
-    outB = call_openai(t["B"].format(elements="\n".join(elements)))
+    t = PROMPT_PARTS[context]
+    # A and B are independent -> dispatch them together
+    outA, outB = call_openai_many([
+        fill_prompt(t["A"], "\n".join(elements)),
+        fill_prompt(t["B"], "\n".join(elements)),
+    ])
+    save_prompt_set(outA, outB, prompt_dir)
+    return outA, outB
+
+
+def save_prompt_set(outA: str, outB: str, prompt_dir: Path):
     ensure_dir(prompt_dir)
     (Path(prompt_dir) / "PromptA_output.txt").write_text(outA, encoding="utf-8")
     (Path(prompt_dir) / "PromptB_output.txt").write_text(outB, encoding="utf-8")
-    return outA, outB
 
 
 def make_merged_table(stem, out_base, outA, outB, obs_df):
@@ -539,8 +719,8 @@ def make_merged_table(stem, out_base, outA, outB, obs_df):
             obs_df.rename(columns={cols[0]: "Element"}, inplace=True)
 
     if "Element" in obs_df.columns:
-        obs_df["Element"] = obs_df["Element"].astype(str).map(lambda x: x.strip())
-        merged = pd.merge(table_ab, obs_df, on="Element", how="left")
+        obs_df["Element"] = obs_df["Element"].astype(str).str.strip()
+        merged = _merge_on_element(table_ab, obs_df, how="left")
         obs_cols = [c for c in obs_df.columns if c != "Element"]
         out_cols = [c for c in merged.columns if c not in obs_cols]
         col_order = ["Element"] + [c for c in out_cols if c != "Element"] + obs_cols
@@ -548,11 +728,8 @@ def make_merged_table(stem, out_base, outA, outB, obs_df):
     else:
         merged = table_ab
 
-    # Strip spaces/nans
-    for col in merged.columns:
-        if merged[col].dtype == "object":
-            merged[col] = merged[col].astype(str).map(lambda x: x.strip()).replace("nan", "")
-    merged.fillna("", inplace=True)
+    # Strip spaces/nans (all columns; numeric ones are written as text anyway)
+    merged = merged.astype(str).apply(lambda s: s.str.strip()).replace("nan", "").fillna("")
 
     tab1_file = tables_dir / f"{stem}_table1.csv"
     merged.to_csv(tab1_file, index=False, encoding="utf-8")
@@ -560,7 +737,8 @@ def make_merged_table(stem, out_base, outA, outB, obs_df):
     return merged, tables_dir
 
 
-def build_table2_3(sample, context, table1, tables_dir, prompt_dir):
+def build_tables_2_3(sample, table1, tables_dir):
+    """Write Table2/Table3 for a sample. Returns (t3, t3_path) or None."""
     req_cols = ["Element", "Observed Shift", "GPT shift 2", "Biological Group"]
     missing = [c for c in req_cols if c not in table1.columns]
     if missing:
@@ -575,12 +753,13 @@ def build_table2_3(sample, context, table1, tables_dir, prompt_dir):
         t2[col] = (
             t2[col]
             .astype(str)
-            .map(lambda x: re.sub(r"\.0+$", "", x.strip()))
+            .str.strip()
+            .str.replace(r"\.0+$", "", regex=True)
             .replace({"nan": ""})
         )
 
     for col in ["Biological Group", "Element"]:
-        t2[col] = t2[col].astype(str).map(lambda x: x.strip())
+        t2[col] = t2[col].astype(str).str.strip()
 
     t2 = t2.sort_values(["Biological Group", "Element"], kind="stable").reset_index(drop=True)
     t2.fillna("", inplace=True)
@@ -597,19 +776,30 @@ def build_table2_3(sample, context, table1, tables_dir, prompt_dir):
     t3_path = Path(tables_dir) / f"{sample}_table3.csv"
     t3.to_csv(t3_path, index=False, encoding="utf-8")
     print(f"Table3 saved: {t3_path}")
+    return t3, t3_path
 
-    # Interpret (Prompt 3)
-    interp_prompt = PROMPTS[context]["INT"].format(table3=t3.to_csv(index=False))
-    interp = call_openai(interp_prompt)
+
+def save_prompt3(sample, interp: str, prompt_dir: Path):
     ensure_dir(prompt_dir)
     (Path(prompt_dir) / f"{sample}_Prompt3_output.txt").write_text(interp, encoding="utf-8")
     print(f"Prompt 3 saved: {Path(prompt_dir) / f'{sample}_Prompt3_output.txt'}")
 
+
+def build_table2_3(sample, context, table1, tables_dir, prompt_dir):
+    built = build_tables_2_3(sample, table1, tables_dir)
+    if built is None:
+        return None
+    t3, t3_path = built
+
+    # Interpret (Prompt 3)
+    interp_prompt = fill_prompt(PROMPT_PARTS[context]["INT"], _csv_text(t3))
+    save_prompt3(sample, call_openai(interp_prompt), prompt_dir)
+
     return t3_path
 
 
 def run_shift_only(stem, ctx, out_base):
-    obs_path = FOLDERS["observed"] / f"{stem}.csv"
+    obs_path = observed_path(stem)
     elements, obs_df = extract_elements(obs_path, Path(out_base) / "elements" / f"{stem}_Elements.txt")
     outA, outB = run_prompt_set(elements, ctx, Path(out_base) / "prompts")
     make_merged_table(stem, out_base, outA, outB, obs_df)
@@ -625,7 +815,7 @@ def run_full(stem, ctx, with_graph, out_base):
       - Graphviz (if requested and Table3 exists)
       - Prompt_Co on the observed CSV
     """
-    obs_path = FOLDERS["observed"] / f"{stem}.csv"
+    obs_path = observed_path(stem)
     elements, obs_df = extract_elements(obs_path, Path(out_base) / "elements" / f"{stem}_Elements.txt")
     outA, outB = run_prompt_set(elements, ctx, Path(out_base) / "prompts")
     merged, tables_dir = make_merged_table(stem, out_base, outA, outB, obs_df)
@@ -647,16 +837,136 @@ def run_interpret(stem, ctx, dot_required, out_base, table3_path=None):
         print(f"Could not read {t3_path}: {e}")
         return
 
-    interp_prompt = PROMPTS[ctx]["INT"].format(table3=df.to_csv(index=False))
-    interp = call_openai(interp_prompt)
-    ensure_dir(Path(out_base) / "prompts")
-    (Path(out_base) / "prompts" / f"{stem}_Prompt3_output.txt").write_text(interp, encoding="utf-8")
-    print(f"Prompt 3 saved: {Path(out_base) / 'prompts' / f'{stem}_Prompt3_output.txt'}")
+    interp_prompt = fill_prompt(PROMPT_PARTS[ctx]["INT"], _csv_text(df))
+    save_prompt3(stem, call_openai(interp_prompt), Path(out_base) / "prompts")
 
     if dot_required:
         graph_highlight(stem, t3_path, Path(out_base) / "graphviz")
 
 
+# ------------------- Batch API (multi-sample) ------------------------------
+BATCH_POLL_SECONDS = 30
+_BATCH_FINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+def _batch_line(custom_id: str, prompt: str) -> str:
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": DEFAULT_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS,
+        },
+    })
+
+
+def run_openai_batch(requests: dict, work_dir: Path, tag: str) -> dict:
+    """
+    Send {custom_id: prompt} through the OpenAI Batch API and wait for it.
+    Input/output JSONL files are kept in 'work_dir' as batch_<tag>_*.jsonl.
+    Returns {custom_id: text}; failed or missing requests map to "".
+    Cached responses are reused and only the misses are submitted.
+    """
+    results = {cid: "" for cid in requests}
+    for cid, prompt in list(requests.items()):
+        cached = _cache_get(prompt)
+        if cached is not None:
+            results[cid] = cached
+    requests = {cid: p for cid, p in requests.items() if not results[cid]}
+    if not requests:
+        return results
+
+    ensure_dir(work_dir)
+    in_path = Path(work_dir) / f"batch_{tag}_input.jsonl"
+    in_path.write_text("".join(_batch_line(cid, p) + "\n" for cid, p in requests.items()),
+                       encoding="utf-8")
+
+    client = _OPENAI_NEW_CLIENT
+    with open(in_path, "rb") as fh:
+        upload = client.files.create(file=fh, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} ({len(requests)} requests)")
+
+    while batch.status not in _BATCH_FINAL:
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+        print(f" Batch {batch.id}: {batch.status}")
+
+    if batch.status != "completed":
+        print(f"Batch {batch.id} ended as '{batch.status}'; keeping any partial results.")
+    if not batch.output_file_id:
+        print("Batch returned no output file.")
+        return results
+
+    raw = client.files.content(batch.output_file_id).text
+    (Path(work_dir) / f"batch_{tag}_output.jsonl").write_text(raw, encoding="utf-8")
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        rec = json.loads(line)
+        body = (rec.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        cid = rec.get("custom_id")
+        if cid in requests and choices:
+            text = (choices[0]["message"].get("content") or "").strip()
+            results[cid] = _cache_put(requests[cid], text)
+    return results
+
+
+def run_batch_full(csv_stems, ctx, out_root: Path):
+    """
+    Same outputs as full_with_graphviz for every sample, but the LLM calls
+    go through two Batch API jobs instead of per-sample chat completions:
+      1) Prompt A + Prompt B for all samples
+      2) Prompt 3 + Prompt_Co once every Table3 exists
+    """
+    if _OPENAI_NEW_CLIENT is None:
+        sys.exit("batch_full requires the openai>=1.x client (Batch API).")
+    t = PROMPT_PARTS[ctx]
+
+    samples = {}
+    requests = {}
+    for stem in csv_stems:
+        out_base = Path(out_root) / stem
+        ensure_dir(out_base)
+        print(f"\n Preparing {stem}.csv as {ctx} -> {out_base}")
+        obs_path = observed_path(stem)
+        elements, obs_df = extract_elements(obs_path, out_base / "elements" / f"{stem}_Elements.txt")
+        samples[stem] = (out_base, obs_path, obs_df)
+        requests[f"{stem}:A"] = fill_prompt(t["A"], "\n".join(elements))
+        requests[f"{stem}:B"] = fill_prompt(t["B"], "\n".join(elements))
+    ab = run_openai_batch(requests, out_root, "AB")
+
+    t3_paths = {}
+    requests = {}
+    for stem, (out_base, obs_path, obs_df) in samples.items():
+        outA, outB = ab[f"{stem}:A"], ab[f"{stem}:B"]
+        save_prompt_set(outA, outB, out_base / "prompts")
+        merged, tables_dir = make_merged_table(stem, out_base, outA, outB, obs_df)
+        built = build_tables_2_3(stem, merged, tables_dir)
+        if built is not None:
+            t3, t3_paths[stem] = built
+            requests[f"{stem}:INT"] = fill_prompt(t["INT"], _csv_text(t3))
+        co_prompt = build_prompt_co(obs_path)
+        if co_prompt is not None:
+            requests[f"{stem}:CO"] = co_prompt
+    second = run_openai_batch(requests, out_root, "INT_CO")
+
+    for stem, (out_base, _, _) in samples.items():
+        if stem in t3_paths:
+            save_prompt3(stem, second[f"{stem}:INT"], out_base / "prompts")
+            graph_highlight(stem, t3_paths[stem], out_base / "graphviz")
+        if f"{stem}:CO" in second:
+            save_prompt_co(stem, second[f"{stem}:CO"], out_base)
+
+
 # ------------------- CLI ---------------------------------------------------
 def parse_cli():
     p = argparse.ArgumentParser("Batch GPT + Graphviz")
@@ -668,20 +978,27 @@ def parse_cli():
         "interpret_only", "interpret_and_graphviz", "graphviz_only",
         # Prompt_Co only
         "prompt_co",
+        # All samples through the Batch API (full_with_graphviz outputs)
+        "batch_full",
     ], required=True)
 
     # Observed options
     p.add_argument("--sample", help="Process single CSV stem (no .csv); else process ALL in observed/")
     p.add_argument("--observed_dir", help="Override path to observed CSV folder")
+    p.add_argument("--no-cache", action="store_true",
+                   help="Always call OpenAI; do not read or write .llm_cache/")
     return p.parse_args()
 
 
 # ------------------- MAIN --------------------------------------------------
 def main():
+    global USE_LLM_CACHE
     args = parse_cli()
+    USE_LLM_CACHE = not args.no_cache
 
     # Observed flows (including prompt_co and full_* running all prompts)
-    csv_stems = sorted([p.stem for p in FOLDERS["observed"].glob("*.csv")])
+    OBSERVED_INDEX.update(index_observed(FOLDERS["observed"]))
+    csv_stems = sorted(OBSERVED_INDEX)
     if args.sample:
         if args.sample not in csv_stems:
             sys.exit(f"Sample '{args.sample}' not found in {FOLDERS['observed']}/")
@@ -689,8 +1006,13 @@ def main():
     if not csv_stems:
         sys.exit(f"No CSV files in {FOLDERS['observed']}/")
 
+    parent_ctx = "Disease" if args.context == "disease" else "Healthy"
+    if args.mode == "batch_full":
+        run_batch_full(csv_stems, args.context, FOLDERS["output"] / parent_ctx)
+        print("\nPipeline finished for all samples.")
+        return
+
     for stem in csv_stems:
-        parent_ctx = "Disease" if args.context == "disease" else "Healthy"
         out_base = FOLDERS["output"] / parent_ctx / stem
         ensure_dir(out_base)
         print(f"\n Processing {stem}.csv as {args.context} -> {out_base}")
@@ -712,7 +1034,7 @@ def main():
             else:
                 print(f" Skipping graphviz_only for {stem}; missing {t3_path}")
         elif args.mode == "prompt_co":
-            obs_path = FOLDERS["observed"] / f"{stem}.csv"
+            obs_path = observed_path(stem)
             run_prompt_co(obs_path, out_base)
 
     print("\nPipeline finished for all samples.")
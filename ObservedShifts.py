@@ -2,64 +2,98 @@
 import os
 import re
 import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 
-print("\n BioShift - Automated Merge + Combination Engine")
-print("=================================================================\n")
+try:
+    from numba import njit  # optional: compiled row resolver for combine_list
+except Exception:
+    njit = None
+
+try:
+    import pyarrow as pa  # optional: multithreaded CSV parser / writer
+    import pyarrow.csv as pacsv
+    CSV_ENGINE = "pyarrow"
+except Exception:
+    pa = pacsv = None
+    CSV_ENGINE = "c"
 
 BASE_DIR = os.getcwd()
 GROUP_DIR_OUT = os.path.join(BASE_DIR, "Observed_Shifts_by_group")
 COMBO_OUT = os.path.join(BASE_DIR, "Observed_Shifts")
 
-os.makedirs(GROUP_DIR_OUT, exist_ok=True)
-os.makedirs(COMBO_OUT, exist_ok=True)
-
-print("Working directory:", BASE_DIR)
-print("Merged outputs  ->", GROUP_DIR_OUT)
-print("Final combos    ->", COMBO_OUT, "\n")
-
 
 # ================================================================
 # PART 1 - MERGE Input_*.csv INSIDE EACH group_*
 # ================================================================
+SHIFT_COLS = ["Element", "Observed Shift"]
+
+# Filename / folder-name patterns, compiled once
+_GROUP_DIR_PAT = re.compile(r"node(\d+)_([A-Za-z0-9_.-]+)$")  # group_1_node201_Cell
+_PAT_A = re.compile(r"(\d+)_([A-Za-z0-9_.-]+)\.csv$")          # 201_Cell.csv
+_PAT_B = re.compile(r"node(\d+)_([A-Za-z0-9_.-]+)\.csv$")      # group_1_node201_Cell.csv
+_PAT_C = re.compile(r"group_(\d+)\.csv$", re.IGNORECASE)       # group_1.csv
+
+
+def _read(path):
+    """Read a shift CSV, parsing only the Element / Observed Shift columns."""
+    if CSV_ENGINE == "pyarrow":
+        return pd.read_csv(path, engine="pyarrow")
+    return pd.read_csv(path, usecols=lambda c: c in SHIFT_COLS)
+
+
 def merge_group_inputs(group_dir):
-    files = [f for f in os.listdir(group_dir)
-             if f.startswith("Input_") and f.endswith(".csv")]
+    """
+    Merge the Input_*.csv files of one group_* folder.
+    Runs in a worker process, so messages are returned instead of printed.
+    Returns: (outname or None, log text)
+    """
+    log = []
+    with os.scandir(group_dir) as it:
+        files = [e.name for e in it
+                 if e.name.startswith("Input_") and e.name.endswith(".csv")]
 
     if not files:
-        print(f"No Input_*.csv in: {group_dir}")
-        return None
+        log.append(f"No Input_*.csv in: {group_dir}")
+        return None, "\n".join(log)
 
     dfs = []
     for f in files:
         path = os.path.join(group_dir, f)
         try:
-            df = pd.read_csv(path)
+            df = _read(path)
         except Exception:
-            print("Error reading:", path)
+            log.append(f"Error reading: {path}")
             continue
 
         if "Element" not in df.columns or "Observed Shift" not in df.columns:
-            print("Invalid columns:", f)
+            log.append(f"Invalid columns: {f}")
             continue
 
-        dfs.append(df[["Element", "Observed Shift"]])
+        dfs.append(df[SHIFT_COLS])
 
     if not dfs:
-        print(f"No valid Input files in {group_dir}")
-        return None
+        log.append(f"No valid Input files in {group_dir}")
+        return None, "\n".join(log)
 
+    # Categorize Element once, after the concat: groupby then works on
+    # integer codes, and the categories are sorted the same way groupby
+    # sorts the raw values (also when numeric IDs and names are mixed)
     merged = pd.concat(dfs, ignore_index=True)
+    merged["Element"] = merged["Element"].astype("category")
 
     # Resolve conflicts: identical -> keep, different -> 0
-    merged = merged.groupby("Element")["Observed Shift"].apply(
-        lambda x: x.iloc[0] if len(set(x)) == 1 else 0
-    ).reset_index()
+    # (a single row is kept as-is, even NaN; repeated NaN counts as a conflict)
+    g = merged.groupby("Element", observed=True)["Observed Shift"]
+    size, count = g.size(), g.count()
+    keep = (size == 1) | ((count == size) & (g.min() == g.max()))
+    merged = g.first().where(keep, 0).reset_index()
 
     base = os.path.basename(group_dir)
 
     # Try to extract node+type from folder name: e.g. group_1_node201_Cell
-    m = re.search(r"node(\d+)_([A-Za-z0-9_.-]+)$", base)
+    m = _GROUP_DIR_PAT.search(base)
     if m:
         node, tname = m.group(1), m.group(2)
         # Compact, standard-style name: 201_Cell.csv
@@ -71,49 +105,46 @@ def merge_group_inputs(group_dir):
     outpath = os.path.join(GROUP_DIR_OUT, outname)
     merged.to_csv(outpath, index=False)
 
-    print(f"MERGED -> {outname}")
-    return outname
+    log.append(f"MERGED -> {outname}")
+    return outname, "\n".join(log)
 
 
-# ---- Find and merge all group_* folders ----
-print("Searching for group_* folders...\n")
+# Output branches that never hold fresh group_* folders
+SKIP_DIRS = {os.path.basename(GROUP_DIR_OUT), os.path.basename(COMBO_OUT)}
 
-group_dirs = []
-for root, dirs, files in os.walk(BASE_DIR):
-    for d in dirs:
-        if d.lower().startswith("group_"):
-            group_dirs.append(os.path.join(root, d))
 
-if not group_dirs:
-    print("No group_* folders found.")
-    exit()
+def _is_run_folder(name):
+    # RunN archives written by SampleBioShift.create_run_folder
+    return name.startswith("Run") and name[3:].isdigit()
 
-print(f"Found {len(group_dirs)} groups:\n")
-for g in group_dirs:
-    print("  -", g)
 
-print("\nMerging groups...\n")
-
-merged_files = []
-for g in group_dirs:
-    out = merge_group_inputs(g)
-    if out:
-        merged_files.append(out)
+def find_groups(root):
+    """
+    Yield group_* folders under root, top-down like os.walk
+    (a level's groups before those of its subfolders).
+    Does not descend into a group_* folder once it is found, nor into
+    this script's outputs or archived RunN folders.
+    """
+    try:
+        with os.scandir(root) as it:
+            dirs = [e for e in it if e.is_dir()]
+    except OSError:
+        return
 
-if not merged_files:
-    print("No merged files created. Aborting combinations.")
-    exit()
+    rest = []
+    for e in dirs:
+        if e.name.lower().startswith("group_"):
+            yield e.path
+        elif not (e.is_symlink() or e.name in SKIP_DIRS or _is_run_folder(e.name)):
+            rest.append(e.path)
 
-print("\nMerging completed.")
-print("---------------------------------------------------------------\n")
+    for d in rest:
+        yield from find_groups(d)
 
 
 # ================================================================
 # PART 2 - HIERARCHICAL COMBINATION LOGIC
 # ================================================================
-print("Starting Combination Engine\n")
-
-
 # ---------- A. Parse merged filenames ----------
 def parse_merge_filename(fname):
     """
@@ -124,125 +155,256 @@ def parse_merge_filename(fname):
     Returns: (node, typename) as strings
     """
     # 1) Format: 201_Cell.csv
-    m = re.match(r"(\d+)_([A-Za-z0-9_.-]+)\.csv$", fname)
+    m = _PAT_A.match(fname)
     if m:
         return m.group(1), m.group(2)
 
     # 2) Format: group_1_node201_Cell.csv
-    m = re.search(r"node(\d+)_([A-Za-z0-9_.-]+)\.csv$", fname)
+    m = _PAT_B.search(fname)
     if m:
         return m.group(1), m.group(2)
 
     # 3) Format: group_1.csv  -> treat as generic "group"
-    m = re.match(r"group_(\d+)\.csv$", fname, re.IGNORECASE)
+    m = _PAT_C.match(fname)
     if m:
         return m.group(1), "group"
 
     return None, None
 
 
-# ---------- B. Organize files by type ----------
-type_to_files = {}
+# ---------- D. Load CSV helper ----------
+def load_shift_csv(path):
+    return _read(path)[SHIFT_COLS]
 
-for fname in merged_files:
-    node, tname = parse_merge_filename(fname)
 
-    if node is None:
-        print("Skipping unrecognized filename:", fname)
-        continue
+# ---------- E. Combine with conflict rule ----------
+if njit is not None:
+    # No fastmath: it assumes no NaNs, and NaN marks a missing shift here
+    @njit(cache=True)
+    def _resolve_rows_jit(a):
+        n, k = a.shape
+        out = np.empty(n)
+        for i in range(n):
+            v = np.nan
+            same = True
+            c = 0
+            for j in range(k):
+                x = a[i, j]
+                if not np.isnan(x):
+                    c += 1
+                    if np.isnan(v):
+                        v = x
+                    elif x != v:
+                        same = False
+            if c == 0:
+                out[i] = np.nan
+            elif same:
+                out[i] = v
+            else:
+                out[i] = 0.0
+        return out
+
+
+def resolve_shifts(values):
+    """
+    Row-wise conflict rule on a 2-D array of shifts (NaN = missing):
+    no value -> NaN, all values equal -> that value, otherwise 0.
+    """
+    arr = np.asarray(values)
+    x = arr.astype(np.float64)
+    if njit is not None:
+        out = _resolve_rows_jit(x)
+    else:
+        valid = ~np.isnan(x)
+        cnt = valid.sum(axis=1)
+        mn = np.where(valid, x, np.inf).min(axis=1)
+        mx = np.where(valid, x, -np.inf).max(axis=1)
+        first = x[np.arange(len(x)), valid.argmax(axis=1)]
+        out = np.where(cnt == 0, np.nan, np.where(mn == mx, first, 0.0))
+    if arr.dtype.kind in "iu":
+        # all-integer inputs cannot be missing; keep them integer like before
+        out = out.astype(arr.dtype)
+    return out
+
+
+def _combine_merge(filelist):
+    # Repeated Elements within one file (e.g. numeric 101 and text "101"
+    # merged as separate groups): keep the outer-merge row expansion
+    merged = None
+    for tname, node, df in filelist:
+        df = df.rename(columns={"Observed Shift": f"{tname}_{node}"})
+        merged = df if merged is None else merged.merge(df, on="Element", how="outer")
+
+    cols = [c for c in merged.columns if c != "Element"]
+    merged["Observed Shift"] = resolve_shifts(merged[cols].to_numpy())
+    return merged[["Element", "Observed Shift"]]
 
-    if tname not in type_to_files:
-        type_to_files[tname] = []
 
-    type_to_files[tname].append((node, fname))
+def combine_list(filelist):
+    """filelist: (tname, node, DataFrame) per merged file in the combination."""
+    # Scatter every file's shifts into one (elements x files) matrix;
+    # sorted uniques give the same row order as the old outer merges
+    frames = [df for _, _, df in filelist]
+    if any(df["Element"].duplicated().any() for df in frames):
+        return _combine_merge(filelist)
+    elements = np.concatenate([df["Element"].to_numpy() for df in frames])
+    shifts = np.concatenate([df["Observed Shift"].to_numpy() for df in frames])
+    src = np.repeat(np.arange(len(frames)), [len(df) for df in frames])
+
+    codes, uniq = pd.factorize(elements, sort=True)
+    mat = np.full((len(uniq), len(frames)), np.nan)
+    mat[codes, src] = shifts
+    if shifts.dtype.kind in "iu" and not np.isnan(mat).any():
+        mat = mat.astype(shifts.dtype)  # nothing missing: stays integer
+
+    return pd.DataFrame({"Element": uniq, "Observed Shift": resolve_shifts(mat)})
+
+
+def _write_csv(df, path):
+    if pacsv is not None:
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path,
+                        pacsv.WriteOptions(quoting_style="needed"))
+    else:
+        df.to_csv(path, index=False, lineterminator="\n")
 
-print("Input types detected:")
-for t in type_to_files:
-    print(f"  - {t} ({len(type_to_files[t])})")
-print()
 
+def _write_combo(job):
+    outname, outpath, filelist = job
+    _write_csv(combine_list(filelist), outpath)
+    return outname
 
-# ---------- C. Determine highest valid combination size ----------
-types = list(type_to_files.keys())
-N = len(types)
 
-if N >= 3:
-    K = 3
-elif N == 2:
-    K = 2
-else:
-    K = 1
+# ================================================================
+# DRIVER
+# ================================================================
+def main():
+    print("\n BioShift - Automated Merge + Combination Engine")
+    print("=================================================================\n")
 
-print(f"Highest valid combination size = {K}-way\n")
+    os.makedirs(GROUP_DIR_OUT, exist_ok=True)
+    os.makedirs(COMBO_OUT, exist_ok=True)
 
+    print("Working directory:", BASE_DIR)
+    print("Merged outputs  ->", GROUP_DIR_OUT)
+    print("Final combos    ->", COMBO_OUT, "\n")
 
-# ---------- D. Load CSV helper ----------
-def load_shift_csv(path):
-    df = pd.read_csv(path)
-    return df[["Element", "Observed Shift"]]
+    # ---- Find and merge all group_* folders ----
+    print("Searching for group_* folders...\n")
 
+    group_dirs = list(find_groups(BASE_DIR))
+
+    if not group_dirs:
+        print("No group_* folders found.")
+        return
+
+    print(f"Found {len(group_dirs)} groups:\n")
+    for g in group_dirs:
+        print("  -", g)
+
+    print("\nMerging groups...\n")
+
+    # Groups are independent (distinct inputs, distinct output file)
+    merged_files = []
+    with ProcessPoolExecutor() as ex:
+        for out, log in ex.map(merge_group_inputs, group_dirs):
+            if log:
+                print(log)
+            if out:
+                merged_files.append(out)
+
+    if not merged_files:
+        print("No merged files created. Aborting combinations.")
+        return
+
+    print("\nMerging completed.")
+    print("---------------------------------------------------------------\n")
+
+    # ---- Combine merged files (PART 2) ----
+    print("Starting Combination Engine\n")
+
+    # ---------- B. Organize files by type ----------
+    type_to_files = {}
+
+    for fname in merged_files:
+        node, tname = parse_merge_filename(fname)
+
+        if node is None:
+            print("Skipping unrecognized filename:", fname)
+            continue
+
+        if tname not in type_to_files:
+            type_to_files[tname] = []
+
+        type_to_files[tname].append((node, fname))
+
+    print("Input types detected:")
+    for t in type_to_files:
+        print(f"  - {t} ({len(type_to_files[t])})")
+    print()
+
+
+    # ---------- C. Determine highest valid combination size ----------
+    types = list(type_to_files.keys())
+    N = len(types)
+
+    if N >= 3:
+        K = 3
+    elif N == 2:
+        K = 2
+    else:
+        K = 1
+
+    print(f"Highest valid combination size = {K}-way\n")
+
+
+    # ---------- D. Load every merged file once ----------
+    # A merged file appears in many combinations; parse it a single time
+    frames = {fname: load_shift_csv(os.path.join(GROUP_DIR_OUT, fname))
+              for files in type_to_files.values() for _, fname in files}
 
-# ---------- E. Combine with conflict rule ----------
-def combine_list(filelist):
-    dfs = []
-    for tname, node, path in filelist:
-        df = load_shift_csv(path).copy()
-        df.rename(columns={"Observed Shift": f"{tname}_{node}"}, inplace=True)
-        dfs.append(df)
-
-    merged = dfs[0]
-    for df in dfs[1:]:
-        merged = merged.merge(df, on="Element", how="outer")
-
-    def resolve(row):
-        vals = [v for v in row if pd.notna(v)]
-        if len(vals) == 0:
-            return None
-        if len(set(vals)) == 1:
-            return vals[0]
-        return 0
-
-    merged["Observed Shift"] = merged.drop(columns=["Element"]).apply(resolve, axis=1)
-    return merged[["Element", "Observed Shift"]]
 
+    # ---------- F. Perform combinations ----------
+    # Names are numbered up front, then the independent writes run in threads
+    combo_counter = 0
+    jobs = []
 
-# ---------- F. Perform combinations ----------
-combo_counter = 0
+    type_groups = list(type_to_files.keys())
 
-type_groups = list(type_to_files.keys())
+    # Generate all K-way combinations of types
+    for tset in itertools.combinations(type_groups, K):
 
-# Generate all K-way combinations of types
-for tset in itertools.combinations(type_groups, K):
+        # Build product of file lists
+        filegrid = [type_to_files[t] for t in tset]
 
-    # Build product of file lists
-    filegrid = [type_to_files[t] for t in tset]
+        for choice in itertools.product(*filegrid):
+            combo_counter += 1
 
-    for choice in itertools.product(*filegrid):
-        combo_counter += 1
+            filelist = []
+            for tname, (node, fname) in zip(tset, choice):
+                filelist.append((tname, node, frames[fname]))
 
-        filelist = []
-        for tname, (node, fname) in zip(tset, choice):
-            fpath = os.path.join(GROUP_DIR_OUT, fname)
-            filelist.append((tname, node, fpath))
+            # Build short tags like C201, P10, M305 from tname + node
+            short_tags = []
+            for tname, node, _ in filelist:
+                abbrev = tname[0].upper() if tname else "T"  # first letter of type
+                short_tags.append(f"{abbrev}{node}")
 
-        # Build short tags like C201, P10, M305 from tname + node
-        short_tags = []
-        for tname, node, _ in filelist:
-            abbrev = tname[0].upper() if tname else "T"  # first letter of type
-            short_tags.append(f"{abbrev}{node}")
+            # Final compact name: 001_C201_P10_M305.csv
+            k = len(tset)  # number of types (just in case you care later)
+            outname = f"{combo_counter:03d}_" + "_".join(short_tags) + ".csv"
+            outpath = os.path.join(COMBO_OUT, outname)
+            jobs.append((outname, outpath, filelist))
 
-        # Final compact name: 001_C201_P10_M305.csv
-        k = len(tset)  # number of types (just in case you care later)
-        outname = f"{combo_counter:03d}_" + "_".join(short_tags) + ".csv"
-        outpath = os.path.join(COMBO_OUT, outname)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for outname in ex.map(_write_combo, jobs):
+            print("Saved:", outname)
 
-        combined = combine_list(filelist)
-        combined.to_csv(outpath, index=False)
 
-        print("Saved:", outname)
+    print("\nALL DONE")
+    print(f"Saved {combo_counter} combined CSVs into:")
+    print("   ->", COMBO_OUT)
+    print("=================================================================")
 
 
-print("\nALL DONE")
-print(f"Saved {combo_counter} combined CSVs into:")
-print("   ->", COMBO_OUT)
-print("=================================================================")
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,160 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
+import errno
 import subprocess
 import sys
 import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import shutil
 
+try:
+    # optional: collect new paths from filesystem events instead of two full walks
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
 BIOSHIFT_MODE = "full_with_graphviz"
+LOG_BUFFER = 1 << 16   # run log is block-buffered; flushed when closed
+READ_CHUNK = 1 << 13   # child output is relayed in chunks of up to 8 KB
+_BAR = "=" * 80
+
+# Top-level items that always stay in the workspace when archiving
+# .llm_cache: BioShift's LLM response cache; __pycache__: Python / numba
+# (ObservedShifts' cache=True kernel) compile caches -- both reused across runs
+SKIP_NAMES = frozenset({".llm_cache", "__pycache__"})
+SKIP_SUFFIXES = (".py", ".R")            # pipeline scripts
 
 # ------------------------------------------------------------------
 # Utilities
 # ------------------------------------------------------------------
 
-def run_or_die(cmd, label, log_fh):
-    header = (
-        "\n" + "=" * 80 +
-        f"\n[RUN] {label}\nCommand: " + " ".join(cmd) +
-        "\n" + "=" * 80 + "\n"
-    )
-    print(header, end="")
-    log_fh.write(header)
+def run_header(cmd, label):
+    return f"\n{_BAR}\n[RUN] {label}\nCommand: {' '.join(cmd)}\n{_BAR}\n"
 
-    result = subprocess.run(
+
+def binary_sink(fh):
+    """
+    Byte stream under a text file (sys.stdout, the run log).
+    Flushes the text layer first so earlier text stays in front.
+    """
+    fh.flush()
+    return fh.buffer
+
+
+def stream_output(cmd, sinks):
+    """
+    Run cmd and relay its stdout+stderr, as raw bytes, to every binary sink;
+    returns the exit code. read1() returns whatever is already in the pipe,
+    so bursts of lines go out as one write per sink while slow output still
+    shows up immediately. Nothing is decoded: the output is only copied.
+    """
+    proc = subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True
+        stderr=subprocess.STDOUT
     )
+    while True:
+        data = proc.stdout.read1(READ_CHUNK)
+        if not data:
+            break
+        for sink in sinks:
+            sink.write(data)
+    proc.stdout.close()
+    return proc.wait()
 
-    if result.stdout:
-        print(result.stdout, end="")
-        log_fh.write(result.stdout)
 
-    if result.returncode != 0:
-        msg = f"\n[ERROR] {label} failed with exit code {result.returncode}\n"
+def run_or_die(cmd, label, log_fh):
+    header = run_header(cmd, label)
+    print(header, end="")
+    log_fh.write(header)
+
+    # Stream the child's output (tee to console + log)
+    returncode = stream_output(cmd, (binary_sink(sys.stdout), binary_sink(log_fh)))
+
+    if returncode != 0:
+        msg = f"\n[ERROR] {label} failed with exit code {returncode}\n"
         print(msg)
         log_fh.write(msg)
-        sys.exit(result.returncode)
+        sys.exit(returncode)
+
+
+class PrefixedConsole:
+    """
+    Binary sink that relays a job's output to the console live, starting
+    every line with "[label] " so concurrent jobs stay readable.
+    Writes hold the shared console lock.
+    """
+
+    def __init__(self, label, lock):
+        self.prefix = f"[{label}] ".encode()
+        self.lock = lock
+        self.at_line_start = True
+
+    def write(self, data):
+        lines = data.splitlines(keepends=True)
+        out = []
+        for line in lines:
+            if self.at_line_start:
+                out.append(self.prefix)
+            out.append(line)
+            self.at_line_start = line.endswith((b"\n", b"\r"))
+        with self.lock:
+            console = binary_sink(sys.stdout)
+            console.write(b"".join(out))
+            console.flush()
+
+
+def run_parallel_or_die(jobs, log_fh, max_workers=2):
+    """
+    Run independent (cmd, label) jobs on a thread pool.
+    Console: each job's output is shown live, line-prefixed with its label.
+    Log: each job's header and output are spooled to its own temp file and
+    appended to the log under a lock when the job finishes, so every job's
+    block stays contiguous there (memory use stays flat).
+    """
+    lock = threading.Lock()
+
+    def run_job(job):
+        cmd, label = job
+        header = run_header(cmd, label)
+        with lock:
+            print(header, end="", flush=True)
+        with tempfile.TemporaryFile() as spool:
+            spool.write(header.encode())
+            returncode = stream_output(cmd, (PrefixedConsole(label, lock), spool))
+            msg = ""
+            if returncode != 0:
+                msg = f"\n[ERROR] {label} failed with exit code {returncode}\n"
+                spool.write(msg.encode())
+            spool.seek(0)
+            with lock:
+                if msg:
+                    print(msg, flush=True)
+                shutil.copyfileobj(spool, binary_sink(log_fh))
+        return returncode
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        codes = list(ex.map(run_job, jobs))
+
+    failed = [c for c in codes if c != 0]
+    if failed:
+        sys.exit(failed[0])
 
 
 def create_run_folder(base_output_dir):
     os.makedirs(base_output_dir, exist_ok=True)
-    runs = [
-        d for d in os.listdir(base_output_dir)
-        if d.startswith("Run") and d[3:].isdigit()
-    ]
-    run_id = max([int(d[3:]) for d in runs], default=0) + 1
+    with os.scandir(base_output_dir) as it:
+        run_ids = [
+            int(e.name[3:]) for e in it
+            if e.name.startswith("Run") and e.name[3:].isdigit()
+        ]
+    run_id = max(run_ids, default=0) + 1
     run_folder = os.path.join(base_output_dir, f"Run{run_id}")
     os.makedirs(run_folder, exist_ok=True)
     return run_folder
@@ -56,62 +164,255 @@ def create_run_folder(base_output_dir):
 # SNAPSHOT LOGIC
 # ------------------------------------------------------------------
 
-def snapshot_state(base_dir):
+def exclude_prefixes(dirs):
+    """Normalize folders once into a tuple for a single str.startswith test."""
+    return tuple(os.path.abspath(d).rstrip(os.sep) + os.sep for d in dirs)
+
+
+def snapshot_state(base_dir, exclude=()):
     """
     Snapshot ALL filesystem paths (files + folders) recursively.
+    Uses os.scandir directly: the entry type comes from the directory
+    listing, so no extra stat() per path.
+    Folders in `exclude` are recorded but never entered.
     """
+    prefixes = exclude_prefixes(exclude)
     paths = set()
-    for root, dirs, files in os.walk(base_dir):
-        for d in dirs:
-            paths.add(os.path.join(root, d))
-        for f in files:
-            paths.add(os.path.join(root, f))
+    stack = [base_dir]
+    # hot loop: bind lookups to locals once
+    scandir, sep, add, push, pop = os.scandir, os.sep, paths.add, stack.append, stack.pop
+    while stack:
+        d = pop()
+        try:
+            it = scandir(d)
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                path = e.path
+                add(path)
+                if e.is_dir(follow_symlinks=False) and not (path + sep).startswith(prefixes):
+                    push(path)
     return paths
 
 
-def move_only_new_outputs(base_dir, run_folder, log_fh, before_snapshot):
+def _has_new_path(root, before_snapshot, prefixes=()):
+    """True as soon as any path under root is missing from before_snapshot."""
+    stack = [root]
+    scandir, sep, push, pop = os.scandir, os.sep, stack.append, stack.pop
+    while stack:
+        d = pop()
+        try:
+            it = scandir(d)
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                path = e.path
+                if (path + sep).startswith(prefixes):
+                    continue
+                if path not in before_snapshot:
+                    return True
+                if e.is_dir(follow_symlinks=False):
+                    push(path)
+    return False
+
+
+def new_top_level_items(base_dir, before_snapshot, exclude=()):
+    """
+    Top-level names in base_dir that are new or contain anything new.
+    Single pass: a new top-level item is not descended into, and an existing
+    one is only scanned until its first new path turns up.
+    Items that are never archived (`exclude`, SKIP_*) are not scanned at all.
+    """
+    prefixes = exclude_prefixes(exclude)
+    items = set()
+    with os.scandir(base_dir) as it:
+        for e in it:
+            if should_skip_item(e.name) or (e.path + os.sep).startswith(prefixes):
+                continue
+            if e.path not in before_snapshot:
+                items.add(e.name)
+            elif e.is_dir(follow_symlinks=False) and _has_new_path(e.path, before_snapshot, prefixes):
+                items.add(e.name)
+    return items
+
+
+WATCH_SENTINEL = ".samplebioshift_watch_end"
+WATCH_DRAIN_TIMEOUT = 30   # seconds to wait for queued events before archiving
+
+
+if Observer is not None:
+    class NewPathHandler(FileSystemEventHandler):
+        """
+        Record every path created (or renamed into place) under the watches.
+        Each watched root gets a sentinel file at the end; once all of them
+        have been seen, every earlier event has been recorded (events of one
+        watch are dispatched in order).
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.paths = set()
+            self.sentinels = set()
+            self.lock = threading.Lock()
+            self.drained = threading.Event()
+
+        def expect(self, sentinels):
+            with self.lock:
+                self.sentinels = set(sentinels)
+
+        def seen(self, sentinel):
+            with self.lock:
+                self.sentinels.discard(sentinel)
+                if not self.sentinels:
+                    self.drained.set()
+
+        def on_created(self, event):
+            if os.path.basename(event.src_path) == WATCH_SENTINEL:
+                self.seen(event.src_path)
+            else:
+                self.paths.add(event.src_path)
+
+        def on_moved(self, event):
+            self.paths.add(event.dest_path)
+
+
+def start_watcher(base_dir, exclude=()):
+    """
+    Watch base_dir for new outputs with watchdog.
+    base_dir itself is watched non-recursively: a new top-level item is
+    archived whole, so its contents need no watch. Existing top-level
+    folders get recursive watches, except `exclude` (the patient folder
+    with its archived runs) and SKIP_* items, which are never archived.
+    Returns (watcher or None, note); note says why snapshot mode is used.
+    """
+    if Observer is None:
+        return None, "watchdog not installed; using snapshot mode"
+    prefixes = exclude_prefixes(exclude)
+    try:
+        handler = NewPathHandler()
+        observer = Observer()
+        roots = [base_dir]
+        observer.schedule(handler, base_dir, recursive=False)
+        with os.scandir(base_dir) as it:
+            for e in it:
+                if (e.is_dir(follow_symlinks=False) and not should_skip_item(e.name)
+                        and not (e.path + os.sep).startswith(prefixes)):
+                    observer.schedule(handler, e.path, recursive=True)
+                    roots.append(e.path)
+        observer.start()
+    except Exception as e:
+        return None, f"file watcher unavailable ({e}); using snapshot mode"
+    return (observer, handler, roots), None
+
+
+def stop_watcher(watcher):
+    """
+    Drain the observer, then stop it.
+    A sentinel file is created in every watched root and we wait until all
+    of their events are dispatched, so events still queued (or held back
+    by the inotify move-pairing delay) are processed first.
+    Returns (created paths that still exist, drained).
+    """
+    observer, handler, roots = watcher
+    sentinels = [os.path.join(r, WATCH_SENTINEL) for r in roots]
+    handler.expect(sentinels)
+    created = []
+    for path in sentinels:
+        try:
+            open(path, "w").close()
+            created.append(path)
+        except OSError:
+            handler.seen(path)   # watched folder removed during the run
+    drained = handler.drained.wait(WATCH_DRAIN_TIMEOUT)
+    for path in created:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    observer.stop()
+    observer.join()
+    return {p for p in handler.paths if os.path.lexists(p)}, drained
+
+
+def move_path(src, dst):
+    """
+    Rename in place when src and dst share a filesystem (metadata only,
+    files and folders alike); copy + delete only for cross-device moves.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def should_skip_item(name):
+    # exact names: one hash lookup; then a single C-level suffix test
+    return name in SKIP_NAMES or name.endswith(SKIP_SUFFIXES)
+
+
+def move_only_new_outputs(base_dir, run_folder, log_fh, before_snapshot, watcher=None):
     """
     Move ALL newly generated outputs (files AND folders) created during the run,
     while preserving workspace integrity.
+    New paths come from the watcher when one ran, else from a snapshot diff.
+    (Watcher mode also archives an item that was deleted and re-created
+    under the same name during the run; the snapshot diff does not.)
     """
 
-    after_snapshot = snapshot_state(base_dir)
-    new_paths = after_snapshot - before_snapshot
-
     print("\n[INFO] Moving ALL newly generated outputs and folders\n")
     log_fh.write("\n[INFO] Moving ALL newly generated outputs and folders\n")
 
-    # Determine TOP-LEVEL new items only
-    top_level_items = set()
-    for p in new_paths:
-        rel = os.path.relpath(p, base_dir)
-        top = rel.split(os.sep)[0]
-        top_level_items.add(top)
-
     patient_root = os.path.dirname(run_folder)
 
+    # Determine TOP-LEVEL new items only
+    if watcher is not None:
+        new_paths, drained = stop_watcher(watcher)
+        if not drained:
+            warn = "[WARN] File watcher did not drain in time; late outputs may stay in place\n"
+            print(warn, end="")
+            log_fh.write(warn)
+        top_level_items = set()
+        for p in new_paths:
+            rel = os.path.relpath(p, base_dir)
+            top = rel.split(os.sep)[0]
+            top_level_items.add(top)
+    else:
+        top_level_items = new_top_level_items(base_dir, before_snapshot,
+                                              exclude=(patient_root,))
+
+    # Items are bare names directly under base_dir: join by plain
+    # concatenation with prefixes normalized once, outside the loop
+    base_sep = os.path.abspath(base_dir) + os.sep
+    run_sep = run_folder + os.sep
+    run_abs = os.path.abspath(run_folder)
+    patient_abs = os.path.abspath(patient_root)
+
     for item in sorted(top_level_items):
-        src = os.path.join(base_dir, item)
-        dst = os.path.join(run_folder, item)
+        src = f"{base_sep}{item}"
+        dst = f"{run_sep}{item}"
 
         # --- SAFETY RULES (CRITICAL) ---
 
         # 1. Never move the run folder itself
-        if os.path.abspath(src) == os.path.abspath(run_folder):
+        if src == run_abs:
             continue
 
         # 2. Never move the patient workspace root
-        if os.path.abspath(src) == os.path.abspath(patient_root):
+        if src == patient_abs:
             continue
 
-        # 3. Never move pipeline scripts
-        if item.endswith((".py", ".R")):
+        # 3. Never move pipeline scripts or BioShift's LLM cache
+        if should_skip_item(item):
             continue
 
         # --------------------------------
 
         try:
-            shutil.move(src, dst)   # CUT + MOVE (folders included)
+            move_path(src, dst)   # CUT + MOVE (folders included)
             msg = f"MOVED: {item}\n"
             print(msg, end="")
             log_fh.write(msg)
@@ -131,6 +432,8 @@ def main():
     parser.add_argument("--samples", nargs="*", default=None)
     parser.add_argument("--python-exe", default="python")
     parser.add_argument("--rscript-exe", default="Rscript")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ask BioShift for fresh LLM responses (ignore .llm_cache)")
     args = parser.parse_args()
 
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -141,13 +444,19 @@ def main():
     run_folder = create_run_folder(base_output_dir)
     log_path = os.path.join(run_folder, "log.txt")
 
-    # SNAPSHOT BEFORE RUN
-    before_snapshot = snapshot_state(base_dir)
+    # SNAPSHOT BEFORE RUN (skipped when a watchdog observer can track changes)
+    # (the patient folder only holds archived runs: never walked or watched)
+    watcher, watch_note = start_watcher(base_dir, exclude=(base_output_dir,))
+    if watch_note:
+        print("[INFO]", watch_note)
+    before_snapshot = None if watcher else snapshot_state(base_dir, exclude=(base_output_dir,))
 
-    with open(log_path, "a", encoding="utf-8") as log_fh:
+    with open(log_path, "a", encoding="utf-8", buffering=LOG_BUFFER) as log_fh:
         log_fh.write("#" * 80 + "\n")
         log_fh.write(f"Run started: {datetime.now().isoformat()}\n")
         log_fh.write(f"Run folder: {run_folder}\n")
+        if watch_note:
+            log_fh.write(f"[INFO] {watch_note}\n")
         log_fh.write("#" * 80 + "\n")
 
         print("\n=== PIPELINE CONFIGURATION ===")
@@ -158,23 +467,23 @@ def main():
         run_or_die([args.rscript_exe, "sampletree_simple.R"], "SampleTree", log_fh)
         run_or_die([args.python_exe, "ObservedShifts.py"], "ObservedShifts", log_fh)
 
-        for ctx in ["disease", "healthy"]:
-            if args.samples:
-                for s in args.samples:
-                    run_or_die(
-                        [args.python_exe, "BioShift.py",
-                         "--context", ctx,
-                         "--mode", BIOSHIFT_MODE,
-                         "--sample", s],
-                        f"BioShift {ctx} {s}", log_fh
-                    )
-            else:
-                run_or_die(
-                    [args.python_exe, "BioShift.py",
-                     "--context", ctx,
-                     "--mode", BIOSHIFT_MODE],
-                    f"BioShift {ctx}", log_fh
-                )
+        # disease / healthy runs are independent -> two at a time
+        contexts = ["disease", "healthy"]
+        cache_flag = ["--no-cache"] if args.no_cache else []
+        if args.samples:
+            jobs = [([args.python_exe, "BioShift.py",
+                      "--context", ctx,
+                      "--mode", BIOSHIFT_MODE,
+                      "--sample", s] + cache_flag,
+                     f"BioShift {ctx} {s}")
+                    for s in args.samples for ctx in contexts]
+        else:
+            jobs = [([args.python_exe, "BioShift.py",
+                      "--context", ctx,
+                      "--mode", BIOSHIFT_MODE] + cache_flag,
+                     f"BioShift {ctx}")
+                    for ctx in contexts]
+        run_parallel_or_die(jobs, log_fh)
         # ---------------- PIPELINE ----------------
 
         # ARCHIVE OUTPUTS
@@ -182,7 +491,8 @@ def main():
             base_dir,
             run_folder,
             log_fh,
-            before_snapshot
+            before_snapshot,
+            watcher
         )
 
     print("\nPipeline complete.")